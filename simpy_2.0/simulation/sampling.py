@@ -0,0 +1,36 @@
+
+"""This module bootstrap samples the historical data that drives
+the supply chain simulation
+
+The demand of every day for each node and the lead time delay of
+every replenishment received by each node are drawn upfront for
+the whole simulation horizon.  Drawing them once per replication
+and passing the same samples to every simulation run gives common
+random numbers: all the candidate solutions of the optimization
+are evaluated against exactly the same demand and lead time
+scenarios, so the difference between their objectives is not
+swamped by sampling noise
+
+"""
+
+
+import numpy as np
+
+
+HORIZON = 360  # days
+
+
+def draw_samples(seedinit, num_nodes, demand, lead_time_delay):
+
+    rng = np.random.default_rng(seedinit)
+
+    # one column of demand per node, except the source node
+    demand_samples = demand[rng.integers(0, demand.shape[0], size=(HORIZON, num_nodes - 1)),
+                            np.arange(num_nodes - 1)]
+
+    # a facility places at most one order per day, so it never
+    # receives more than one replenishment per day of the horizon
+    lt_samples = lead_time_delay[rng.integers(0, len(lead_time_delay), size=(num_nodes, HORIZON))]
+
+    return demand_samples, lt_samples
+
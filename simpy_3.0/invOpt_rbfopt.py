@@ -1,124 +1,162 @@
-
-"""This module calls the multi-echelon supply chain simulation
-as a black box function to optimize inventory policy
-"""
-
-__author__ = 'Anshul Agarwal'
-
-
-from simulation.simLostSales import simulate_network
-#from simulation.simBackorder import simulate_network
-import numpy as np
-import rbfopt
-import csv
-import time
-
-
-# Read the historical demand data
-demandAllNodes = []
-with open('data/demandData.csv', 'r') as f:
-    next(f)  # skip headings
-    reader = csv.reader(f)
-    for a in reader:
-        demandAllNodes.append([float(j) for j in a])
-
-demandAllNodes = np.array(demandAllNodes)  # contains all nodes except the source node
-
-# Read the historical data on lead time delay
-leadTimeDelay = []
-with open('data/leadTimeExtraDays.csv', 'r') as f:
-    reader = csv.reader(f)
-    for a in reader:
-        leadTimeDelay.append(int(a[0]))
-
-leadTimeDelay = np.array(leadTimeDelay)
-
-# Define the supply chain network
-numNodes = 6
-nodeNetwork = np.zeros((numNodes, numNodes))
-nodeNetwork[0, 1] = 1
-nodeNetwork[1, 2] = 1
-nodeNetwork[1, 3] = 1
-nodeNetwork[3, 4] = 1
-nodeNetwork[3, 5] = 1
-
-# Initialize network nodes
-defaultLeadTime = np.array([0, 3, 4, 4, 2, 2])
-serviceTarget = np.array([0.0, 0.95, 0.95, 0.0, 0.95, 0.95])
-
-
-# function to evaluate the objective function for optimization
-# we minimize on-hand inventory and heavily penalize not meeting
-# the beta service level (demand volume based)
-
-def getObj(initial_guess):
-    
-    # Split the initial guess to get base stock and ROP
-    excess_inventory_guess = initial_guess[:(numNodes - 1)]
-    ROP_guess = initial_guess[(numNodes - 1):]
-    base_stock_guess = np.add(excess_inventory_guess, ROP_guess)
-    
-    # Insert the supply node's base stock
-    baseStock = np.insert(base_stock_guess, 0, 10000)
-    
-    # Insert a zero ROP for the first source node
-    ROP = np.insert(ROP_guess, 0, 0)
-    
-    # Initialize inventory level
-    initialInv = 0.9*baseStock
-    
-    replications = 20
-    totServiceLevel = np.zeros(numNodes)
-    totAvgOnHand = 0.0
-    for i in range(replications):
-        nodes = simulate_network(i,numNodes,nodeNetwork,initialInv,ROP,baseStock,
-                                 demandAllNodes,defaultLeadTime,leadTimeDelay)
-    	
-        totServiceLevel = np.array([totServiceLevel[j] + 
-                                    nodes[j].serviceLevel for j in range(len(nodes))]) #convert list to array
-    	
-        totAvgOnHand += np.sum([nodes[j].avgOnHand for j in range(len(nodes))])
-    
-    servLevelPenalty = np.maximum(0, serviceTarget - totServiceLevel/replications) # element-wise max
-    objFunValue = totAvgOnHand/replications + 1.0e6*np.sum(servLevelPenalty)
-    return objFunValue
-
-
-######## Main statements to call optimization ########
-excess_inventory_initial_guess = [2000, 350, 700, 150, 400]
-ROP_initial_guess = [1000, 250, 200, 150, 200]
-guess = excess_inventory_initial_guess + ROP_initial_guess # concatenate lists
-numVars = len(guess)
-
-settings = rbfopt.RbfoptSettings(max_evaluations=5000,
-                                global_search_method='solver',
-                                rand_seed=707,
-								minlp_solver_path="/path/to/bonmin",
-								nlp_solver_path="/path/to/ipopt")
-
-start_time = time.time()
-bb = rbfopt.RbfoptUserBlackBox(numVars, np.array([0] * numVars), np.array(guess),
-                               np.array(['R'] * numVars), getObj)
-alg = rbfopt.RbfoptAlgorithm(settings, bb)
-val, x, itercount, evalcount, fast_evalcount = alg.optimize()
-elapsed_time = (time.time() - start_time)/60.0
-
-print("\nFinal objective: " + "{0:10.3f}".format(val))
-print("\nFinal solution: " + str(x))
-print("\nTotal time: " + "{0:3.2f}".format(elapsed_time) + " minutes")
-
-"""
-Backorder case 
-
-Final objective:    950.642
-Final solution: [3.73352342e-01, 5.76883222e+01, 2.29893706e+02, 9.73294467e+01, 4.63031579e+01, 
-8.34464787e+02, 1.96369932e+02, 1.87766439e+02, 8.35991661e+01, 2.00000000e+02]
-Total time: 5048.39 seconds
-
-Lost sales case
-
-Final objective:   1145.803
-Final solution: [8.27825917e+02, 6.64267881e+01, 3.15525949e+02, 4.63218585e-02, 5.85635897e+01, 
-7.21927771e+02, 2.14184451e+02, 1.35273516e+02, 9.91709664e+01, 2.00000000e+02]
-Total time: 116.97 minutes
-"""
+
+"""This module calls the multi-echelon supply chain simulation
+as a black box function to optimize inventory policy
+"""
+
+__author__ = 'Anshul Agarwal'
+
+
+import simulation.simLostSales as simModel
+#import simulation.simLostSalesNumba as simModel
+#import simulation.simLostSalesCython as simModel  # build with setup.py first
+#import simulation.simBackorder as simModel
+#import simulation.simBackorderNumba as simModel
+from simulation.sampling import draw_samples, stack_samples
+import numpy as np
+import rbfopt
+import time
+import multiprocessing
+import os
+
+
+# Read the historical demand data
+demandAllNodes = np.loadtxt('data/demandData.csv', delimiter=',', skiprows=1)  # contains all nodes except the source node
+
+# Read the historical data on lead time delay
+leadTimeDelay = np.loadtxt('data/leadTimeExtraDays.csv', delimiter=',', dtype=int)
+
+# Define the supply chain network
+numNodes = 6
+nodeNetwork = np.zeros((numNodes, numNodes))
+nodeNetwork[0, 1] = 1
+nodeNetwork[1, 2] = 1
+nodeNetwork[1, 3] = 1
+nodeNetwork[3, 4] = 1
+nodeNetwork[3, 5] = 1
+
+# Initialize network nodes
+defaultLeadTime = np.array([0, 3, 4, 4, 2, 2])
+serviceTarget = np.array([0.0, 0.95, 0.95, 0.0, 0.95, 0.95])
+
+# Bootstrap sample the demand and lead time delay of every replication
+# once, so that all the candidate solutions are simulated with the same
+# random numbers (common random numbers)
+replications = 20
+replicationSamples = [draw_samples(i, numNodes, demandAllNodes, leadTimeDelay)
+                      for i in range(replications)]
+
+# The Numba simulators are compiled for this network and simulate all
+# the replications of an objective evaluation in a single call, on the
+# samples stacked along a leading axis
+if hasattr(simModel, 'specialize_network'):
+    simulate_replications = simModel.specialize_network(numNodes, nodeNetwork, defaultLeadTime)
+else:
+    simulate_replications = None
+demandSamples, ltSamples = stack_samples(replicationSamples)
+
+
+# Work arrays for the base stock, ROP and initial inventory of all the
+# nodes, filled in place by every objective evaluation.  The entries of
+# the supply node never change
+_baseStock = np.empty(numNodes)
+_baseStock[0] = 10000.0
+_ROP = np.empty(numNodes)
+_ROP[0] = 0.0
+_initialInv = np.empty(numNodes)
+
+
+# function to simulate a single replication in a worker process
+# the workers get the datasets and the replication samples from the
+# module globals, so a task only carries the seed and the inventory
+# policy, and only the service levels and the total average on-hand
+# inventory are sent back to the parent
+def _run_one(seed_and_args):
+
+    seed, initialInv, ROP, baseStock = seed_and_args
+    serviceLevel, avgOnHand = simModel.simulate_network(seed,numNodes,nodeNetwork,initialInv,ROP,baseStock,
+                                                demandAllNodes,defaultLeadTime,leadTimeDelay,
+                                                samples=replicationSamples[seed])
+    return serviceLevel, np.sum(avgOnHand)
+
+
+# function to evaluate the objective function for optimization
+# we minimize on-hand inventory and heavily penalize not meeting
+# the beta service level (demand volume based)
+
+def getObj(initial_guess):
+    
+    # Split the initial guess to get base stock and ROP, leaving
+    # the supply node's base stock and zero ROP in place
+    np.add(initial_guess[:(numNodes - 1)], initial_guess[(numNodes - 1):], out=_baseStock[1:])
+    _ROP[1:] = initial_guess[(numNodes - 1):]
+    
+    # Initialize inventory level
+    np.multiply(_baseStock, 0.9, out=_initialInv)
+    
+    if simulate_replications is not None:
+        serviceLevels, avgOnHand = simulate_replications(_initialInv, _ROP, _baseStock, demandSamples, ltSamples)
+        totServiceLevel = serviceLevels.sum(axis=0)
+        totAvgOnHand = avgOnHand.sum()
+    else:
+        args_iter = [(i, _initialInv, _ROP, _baseStock) for i in range(replications)]
+        results = _pool.map(_run_one, args_iter)
+        totServiceLevel = np.sum([r[0] for r in results], axis=0)
+        totAvgOnHand = np.sum([r[1] for r in results])
+    
+    servLevelPenalty = np.maximum(0, serviceTarget - totServiceLevel/replications) # element-wise max
+    objFunValue = totAvgOnHand/replications + 1.0e6*np.sum(servLevelPenalty)
+    return objFunValue
+
+
+######## Main statements to call optimization ########
+if __name__ == '__main__':
+    # the replications are simulated in a process pool, unless the
+    # simulator runs them all in one call
+    _pool = None if simulate_replications is not None else multiprocessing.Pool(processes=os.cpu_count())
+
+    excess_inventory_initial_guess = [2000, 350, 700, 150, 400]
+    ROP_initial_guess = [1000, 250, 200, 150, 200]
+    guess = excess_inventory_initial_guess + ROP_initial_guess # concatenate lists
+    numVars = len(guess)
+
+    settings = rbfopt.RbfoptSettings(max_evaluations=5000,
+                                    global_search_method='solver',
+                                    rand_seed=707,
+    								minlp_solver_path="/path/to/bonmin",
+    								nlp_solver_path="/path/to/ipopt")
+
+    start_time = time.time()
+    bb = rbfopt.RbfoptUserBlackBox(numVars, np.array([0] * numVars), np.array(guess),
+                                   np.array(['R'] * numVars), getObj)
+    alg = rbfopt.RbfoptAlgorithm(settings, bb)
+    val, x, itercount, evalcount, fast_evalcount = alg.optimize()
+    elapsed_time = (time.time() - start_time)/60.0
+
+    print("\nFinal objective: " + "{0:10.3f}".format(val))
+    print("\nFinal solution: " + str(x))
+    print("\nTotal time: " + "{0:3.2f}".format(elapsed_time) + " minutes")
+
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+
+"""
+Results of the original run, when every objective evaluation drew new
+random numbers for the SimPy simulation.  The objective now simulates
+the same common random numbers with the day loop simulation, so these
+numbers are not reproduced exactly
+
+Backorder case 
+
+Final objective:    950.642
+Final solution: [3.73352342e-01, 5.76883222e+01, 2.29893706e+02, 9.73294467e+01, 4.63031579e+01, 
+8.34464787e+02, 1.96369932e+02, 1.87766439e+02, 8.35991661e+01, 2.00000000e+02]
+Total time: 5048.39 seconds
+
+Lost sales case
+
+Final objective:   1145.803
+Final solution: [8.27825917e+02, 6.64267881e+01, 3.15525949e+02, 4.63218585e-02, 5.85635897e+01, 
+7.21927771e+02, 2.14184451e+02, 1.35273516e+02, 9.91709664e+01, 2.00000000e+02]
+Total time: 116.97 minutes
+"""
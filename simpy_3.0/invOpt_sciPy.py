@@ -1,153 +1,191 @@
-
-"""This module calls the multi-echelon supply chain simulation
-as a black box function to optimize inventory policy
-"""
-
-__author__ = 'Anshul Agarwal'
-
-
-from simulation.simLostSales import simulate_network
-#from simulation.simBackorder import simulate_network
-import numpy as np
-import scipy.optimize
-import csv
-import time
-
-
-# Read the historical demand data
-demandAllNodes = []
-with open('data/demandData.csv', 'r') as f:
-    next(f)  # skip headings
-    reader = csv.reader(f)
-    for a in reader:
-        demandAllNodes.append([float(j) for j in a])
-
-demandAllNodes = np.array(demandAllNodes)  # contains all nodes except the source node
-
-# Read the historical data on lead time delay
-leadTimeDelay = []
-with open('data/leadTimeExtraDays.csv', 'r') as f:
-    reader = csv.reader(f)
-    for a in reader:
-        leadTimeDelay.append(int(a[0]))
-
-leadTimeDelay = np.array(leadTimeDelay)
-
-# Define the supply chain network
-numNodes = 6
-nodeNetwork = np.zeros((numNodes, numNodes))
-nodeNetwork[0, 1] = 1
-nodeNetwork[1, 2] = 1
-nodeNetwork[1, 3] = 1
-nodeNetwork[3, 4] = 1
-nodeNetwork[3, 5] = 1
-
-# Initialize network nodes
-defaultLeadTime = np.array([0, 3, 4, 4, 2, 2])
-serviceTarget = np.array([0.0, 0.95, 0.95, 0.0, 0.95, 0.95])
-
-# Combine all datasets
-allData = {'dd': demandAllNodes,\
-            'lt': leadTimeDelay,\
-            'n': numNodes,\
-            'net': nodeNetwork,\
-            'dlt': defaultLeadTime,\
-            'sl': serviceTarget
-        }
-
-# function to evaluate the objective function for optimization
-# we minimize on-hand inventory and heavily penalize not meeting
-# the beta service level (demand volume based)
-def getObj(initial_guess, args):
-
-    demandAllNodes,\
-    leadTimeDelay,\
-    numNodes,\
-    nodeNetwork,\
-    defaultLeadTime,\
-    serviceTarget = args['dd'],args['lt'],args['n'],args['net'],args['dlt'],args['sl']
-	
-    # Split the initial guess to get base stock and ROP
-    excess_inventory_guess = initial_guess[:(numNodes - 1)]
-    ROP_guess = initial_guess[(numNodes - 1):]
-    base_stock_guess = np.add(excess_inventory_guess, ROP_guess)
-    
-    # Insert the supply node's base stock
-    baseStock = np.insert(base_stock_guess, 0, 10000)
-    
-    # Insert a zero ROP for the first source node
-    ROP = np.insert(ROP_guess, 0, 0)
-    
-    # Initialize inventory level
-    initialInv = 0.9*baseStock
-    
-    replications = 20
-    totServiceLevel = np.zeros(numNodes)
-    totAvgOnHand = 0.0
-    for i in range(replications):
-        nodes = simulate_network(i,numNodes,nodeNetwork,initialInv,ROP,baseStock,
-                                 demandAllNodes,defaultLeadTime,leadTimeDelay)
-		
-        totServiceLevel = np.array([totServiceLevel[j] + 
-                                    nodes[j].serviceLevel for j in range(len(nodes))]) #convert list to array
-		
-        totAvgOnHand += np.sum([nodes[j].avgOnHand for j in range(len(nodes))])
-    
-    servLevelPenalty = np.maximum(0, serviceTarget - totServiceLevel/replications) # element-wise max
-    objFunValue = totAvgOnHand/replications + 1.0e6*np.sum(servLevelPenalty)
-    return objFunValue
-
-
-# Callback function to print optimization iterations
-niter = 1
-def callbackF(xk):
-    global niter
-    print('{0:4d}    {1:6.6f}'.format(niter, getObj(xk, allData)))
-    niter += 1
-
-
-######## Main statements to call optimization ########
-excess_inventory_initial_guess = [2000, 350, 700, 150, 400]
-ROP_initial_guess = [1000, 250, 200, 150, 200]
-guess = excess_inventory_initial_guess + ROP_initial_guess # concatenate lists
-
-NUM_CYCLES = 100
-TIME_LIMIT = 1440 # minutes
-start_time = time.time()
-print("\nMax time limit: " + str(TIME_LIMIT) + " minutes")
-print("Max algorithm cycles: " + str(NUM_CYCLES) + " (50 iterations per cycle)")
-print("The algorithm will run either for " + str(TIME_LIMIT) + " minutes or " + str(NUM_CYCLES) + " cycles")
-ctr = 1
-elapsed_time = (time.time() - start_time)/60.0
-while ctr <= NUM_CYCLES and elapsed_time <= TIME_LIMIT:
-    print('\nCycle: ' + str(ctr))
-    print('{0:4s}    {1:9s}'.format('Iter', 'Obj'))
-    optROP = scipy.optimize.minimize(fun=getObj
-    							, x0=guess
-    							, args=allData
-    							, method='Nelder-Mead'
-    							, callback=callbackF
-    							, options={'disp': True,'maxiter':50})
-    guess = optROP.x
-    ctr += 1
-    elapsed_time = (time.time() - start_time)/60.0
-
-print("\nFinal objective: " + "{0:10.3f}".format(getObj(optROP.x, allData)))
-print("\nFinal solution: " + str(optROP.x))
-print("\nTotal time: " + "{0:3.2f}".format(elapsed_time) + " minutes")
-
-"""
-Backorder case
-
-Final objective:   2515.907
-Final solution: [1931.86354959  377.72872864  736.9682174   158.17153186  398.36439462
-  804.25245856  257.3739692   212.75370283  148.60471354  199.1309216 ]
-Total time: 247.70 minutes
-
-Lost sales case
-
-Final objective:   2445.776
-Final solution: [1786.42510894  366.71494378  738.71965624  149.67503675  404.78298398
-  729.16331933  276.13613632  197.82782439  158.76006432  219.87721725]
-Total time: 236.91 minutes
-"""
+
+"""This module calls the multi-echelon supply chain simulation
+as a black box function to optimize inventory policy
+"""
+
+__author__ = 'Anshul Agarwal'
+
+
+import simulation.simLostSales as simModel
+#import simulation.simLostSalesNumba as simModel
+#import simulation.simLostSalesCython as simModel  # build with setup.py first
+#import simulation.simBackorder as simModel
+#import simulation.simBackorderNumba as simModel
+from simulation.sampling import draw_samples, stack_samples
+import numpy as np
+import scipy.optimize
+import time
+import multiprocessing
+import os
+import functools
+
+
+# Read the historical demand data
+demandAllNodes = np.loadtxt('data/demandData.csv', delimiter=',', skiprows=1)  # contains all nodes except the source node
+
+# Read the historical data on lead time delay
+leadTimeDelay = np.loadtxt('data/leadTimeExtraDays.csv', delimiter=',', dtype=int)
+
+# Define the supply chain network
+numNodes = 6
+nodeNetwork = np.zeros((numNodes, numNodes))
+nodeNetwork[0, 1] = 1
+nodeNetwork[1, 2] = 1
+nodeNetwork[1, 3] = 1
+nodeNetwork[3, 4] = 1
+nodeNetwork[3, 5] = 1
+
+# Initialize network nodes
+defaultLeadTime = np.array([0, 3, 4, 4, 2, 2])
+serviceTarget = np.array([0.0, 0.95, 0.95, 0.0, 0.95, 0.95])
+
+# Bootstrap sample the demand and lead time delay of every replication
+# once, so that all the candidate solutions are simulated with the same
+# random numbers (common random numbers)
+replications = 20
+replicationSamples = [draw_samples(i, numNodes, demandAllNodes, leadTimeDelay)
+                      for i in range(replications)]
+
+# The Numba simulators are compiled for this network and simulate all
+# the replications of an objective evaluation in a single call, on the
+# samples stacked along a leading axis
+if hasattr(simModel, 'specialize_network'):
+    simulate_replications = simModel.specialize_network(numNodes, nodeNetwork, defaultLeadTime)
+else:
+    simulate_replications = None
+demandSamples, ltSamples = stack_samples(replicationSamples)
+
+# Work arrays for the base stock, ROP and initial inventory of all the
+# nodes, filled in place by every objective evaluation.  The entries of
+# the supply node never change
+_baseStock = np.empty(numNodes)
+_baseStock[0] = 10000.0
+_ROP = np.empty(numNodes)
+_ROP[0] = 0.0
+_initialInv = np.empty(numNodes)
+
+
+# function to simulate a single replication in a worker process
+# the workers get the datasets and the replication samples from the
+# module globals, so a task only carries the seed and the inventory
+# policy, and only the service levels and the total average on-hand
+# inventory are sent back to the parent
+def _run_one(seed_and_args):
+
+    seed, initialInv, ROP, baseStock = seed_and_args
+    serviceLevel, avgOnHand = simModel.simulate_network(seed,numNodes,nodeNetwork,initialInv,ROP,baseStock,
+                                                demandAllNodes,defaultLeadTime,leadTimeDelay,
+                                                samples=replicationSamples[seed])
+    return serviceLevel, np.sum(avgOnHand)
+
+
+# function to evaluate the objective function for optimization
+# Nelder-Mead re-evaluates some points and the callback reports the
+# objective of a point the optimizer has already evaluated, so the
+# evaluations are cached on the guess rounded to two decimals
+def getObj(initial_guess):
+    return _getObj_cached(tuple(np.round(initial_guess, 2)))
+
+
+@functools.lru_cache(maxsize=256)
+def _getObj_cached(x_tuple):
+    return _simulateObj(np.array(x_tuple))
+
+
+# function to simulate the objective function for optimization
+# we minimize on-hand inventory and heavily penalize not meeting
+# the beta service level (demand volume based)
+def _simulateObj(initial_guess):
+
+    # Split the initial guess to get base stock and ROP, leaving
+    # the supply node's base stock and zero ROP in place
+    np.add(initial_guess[:(numNodes - 1)], initial_guess[(numNodes - 1):], out=_baseStock[1:])
+    _ROP[1:] = initial_guess[(numNodes - 1):]
+    
+    # Initialize inventory level
+    np.multiply(_baseStock, 0.9, out=_initialInv)
+    
+    if simulate_replications is not None:
+        serviceLevels, avgOnHand = simulate_replications(_initialInv, _ROP, _baseStock, demandSamples, ltSamples)
+        totServiceLevel = serviceLevels.sum(axis=0)
+        totAvgOnHand = avgOnHand.sum()
+    else:
+        args_iter = [(i, _initialInv, _ROP, _baseStock) for i in range(replications)]
+        results = _pool.map(_run_one, args_iter)
+        totServiceLevel = np.sum([r[0] for r in results], axis=0)
+        totAvgOnHand = np.sum([r[1] for r in results])
+    
+    servLevelPenalty = np.maximum(0, serviceTarget - totServiceLevel/replications) # element-wise max
+    objFunValue = totAvgOnHand/replications + 1.0e6*np.sum(servLevelPenalty)
+    return objFunValue
+
+
+# Callback function to print optimization iterations
+# xk is the best vertex of the simplex, which Nelder-Mead has already
+# evaluated, so its objective is a cache hit and costs no simulation
+niter = 1
+def callbackF(xk):
+    global niter
+    print('{0:4d}    {1:6.6f}'.format(niter, getObj(xk)))
+    niter += 1
+
+
+######## Main statements to call optimization ########
+if __name__ == '__main__':
+    # the replications are simulated in a process pool, unless the
+    # simulator runs them all in one call
+    _pool = None if simulate_replications is not None else multiprocessing.Pool(processes=os.cpu_count())
+
+    excess_inventory_initial_guess = [2000, 350, 700, 150, 400]
+    ROP_initial_guess = [1000, 250, 200, 150, 200]
+    guess = excess_inventory_initial_guess + ROP_initial_guess # concatenate lists
+
+    NUM_CYCLES = 100
+    TIME_LIMIT = 1440 # minutes
+    start_time = time.time()
+    print("\nMax time limit: " + str(TIME_LIMIT) + " minutes")
+    print("Max algorithm cycles: " + str(NUM_CYCLES) + " (50 iterations per cycle)")
+    print("The algorithm will run either for " + str(TIME_LIMIT) + " minutes or " + str(NUM_CYCLES) + " cycles")
+    ctr = 1
+    elapsed_time = (time.time() - start_time)/60.0
+    while ctr <= NUM_CYCLES and elapsed_time <= TIME_LIMIT:
+        print('\nCycle: ' + str(ctr))
+        print('{0:4s}    {1:9s}'.format('Iter', 'Obj'))
+        # the default tolerances of 1e-4 are far tighter than the noise in the
+        # simulated objective, so end a cycle once the simplex has collapsed
+        # to within 10 units and 1.0 of objective
+        optROP = scipy.optimize.minimize(fun=getObj
+        							, x0=guess
+        							, method='Nelder-Mead'
+        							, callback=callbackF
+        							, options={'disp': True,'maxiter':50,'xatol':10.0,'fatol':1.0})
+        guess = optROP.x
+        ctr += 1
+        elapsed_time = (time.time() - start_time)/60.0
+
+    print("\nFinal objective: " + "{0:10.3f}".format(getObj(optROP.x)))
+    print("\nFinal solution: " + str(optROP.x))
+    print("\nTotal time: " + "{0:3.2f}".format(elapsed_time) + " minutes")
+
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+
+"""
+Results with the Numba simulators on a single core.  The other
+simulators find the same solutions, only the time differs
+
+Backorder case
+
+Final objective:   2469.996
+Final solution: [1881.84148485  350.37252792  751.99454039  161.56369608  403.18328774
+  731.3649966   273.06586753  213.39027939  141.99640101  210.25940168]
+Total time: 0.07 minutes
+
+Lost sales case
+
+Final objective:   2455.282
+Final solution: [1898.90056109  356.857527    643.01275227  165.62557434  396.09061871
+  676.12171585  259.35126971  210.01881389  168.96400725  215.56487598]
+Total time: 0.07 minutes
+"""
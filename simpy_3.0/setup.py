@@ -0,0 +1,21 @@
+
+"""This module builds the Cython version of the lost sales
+simulation in place, next to the other simulation modules:
+
+    python setup.py build_ext --inplace
+
+It is only needed for simulation/simLostSalesCython.pyx, the other
+simulation modules are plain Python or compiled by Numba on first call
+"""
+
+__author__ = 'Anshul Agarwal'
+
+
+from setuptools import setup
+from Cython.Build import cythonize
+
+
+setup(
+    name='simLostSalesCython',
+    ext_modules=cythonize('simulation/simLostSalesCython.pyx', language_level=3),
+)
@@ -1,196 +1,168 @@
-
-"""This module simulates a multi-echelon supply chain
-and calculates inventory profile (along with associated inventory 
-parameters such as on-hand, inventory position, service level, etc.) 
-across time
-
-The system follows a base stock policy with a reorder point
-If inventory position <= ROP, an order of the amount 
-(base stock level - current inventory level) is placed by the
-facility.  Essentially it's equivalent to filling up the tank.
-
-It is assumed that any unfulfilled order is backordered
-and is fulfilled whenever the material is available in the
-inventory.  The service level is estimated based on how
-late the order was fulfilled
-
-One of the key features is that we do not assume any 
-pre-defined distribution for demand and lead time.  We follow a
-data-driven distribution.  In other words, we bootstrap sample 
-from the historical data in order to simulate variability in
-both demand and lead time.  However, this inherently assumes
-that there is no time correlation in historical demand and 
-lead time, as well as the future will be similar to history
-
-The discrete-event simulation model stands on four 
-different processes:
-1) Place replenishment order: 
-    Process used by stocking locations to place replenishment
-    order to upstream facilities once inventory levels reach 
-    below reorder point
-2) Fulfill replenishment order:
-    Process used by a facility to prepare and ship the
-    replenishment ordered by its downstream facility.  Once
-    the order is prepared, it fires a delivery process
-3) Deliver replenishment:
-    Process invoked by fulfill order.  Each replenishment 
-    delivery is handled by this process.  It delivers the
-    replenishment after lead time, thus increasing downstream
-    facility's on hand inventory
-4) Customer demand:
-    Basic process to deliver customer demand from each of the
-    serving locations
-
-Assumption:  The first node is the supply node such as
-a manufacturing plant or a vendor for which we do not
-track inventory, i.e., it operates at 100% service level
-
-"""
-
-__author__ = 'Anshul Agarwal'
-
-
-import simpy
-import numpy as np
-
-
-"""Class for new replenishment order placed
-by a stocking facility to its upstream
-replenishing stocking facility.  The order object
-contains order quantity and which facility is
-placing that order
-"""
-class new_order(object):
-
-    def __init__(self, requester, order_qty):
-        self.requester = requester
-        self.orderQty = order_qty
-
-
-"""Stocking facility class
-Each stocking location in the multi-echelon 
-network is an object of this class
-"""
-class stocking_facility(object):
-    
-    # initialize the new facility object
-    def __init__(self, env, node_id, is_source, initial_inv, ROP, base_stock,
-                 upstream, hist_demand, default_lead_time, lead_time_delay):
-        self.env = env
-        self.name = "node" + str(node_id)
-        self.isSource = is_source
-        self.on_hand_inventory = initial_inv
-        self.inventory_position = initial_inv
-        self.ROP = ROP
-        self.baseStock = base_stock
-        self.upstream = upstream
-        self.histDemand = hist_demand
-        self.defaultLeadTime = default_lead_time
-        self.leadTimeDelay = lead_time_delay
-        self.order_q = []
-        self.totalDemand = 0.0
-        self.totalBackOrder = 0.0
-        self.totalLateSales = 0.0
-        self.serviceLevel = 0.0
-        self.avgOnHand = 0.0
-        self.onHandMon = []
-        
-        # start the processes
-        self.env.process(self.check_inventory())
-        self.env.process(self.prepare_replenishment())
-        self.env.process(self.serve_customer())
-        
-
-    # process to place replenishment order
-    def check_inventory(self):
-        while True:
-            yield self.env.timeout(1.0)
-            if self.inventory_position <= 1.05 * self.ROP:  # add 5% to avoid rounding issues
-                order_qty = self.baseStock - self.on_hand_inventory
-                order = new_order(self, order_qty)
-                self.upstream.order_q.append(order)
-                self.inventory_position += order_qty
-
-    # process to fulfill replenishment order
-    def prepare_replenishment(self):
-        while True:
-            if len(self.order_q) > 0:
-                order = self.order_q.pop(0)
-
-                shipment = min(order.orderQty, self.on_hand_inventory)
-                if not self.isSource:
-                    self.inventory_position -= shipment
-                    self.on_hand_inventory -= shipment
-    
-                # if the order is not complete, wait for the material to appear
-                # in the inventory before the complete replenishment can be sent
-                remaining_order = order.orderQty - shipment
-                if remaining_order:
-                    while not self.on_hand_inventory >= remaining_order:
-                        yield self.env.timeout(1.0)
-                    if not self.isSource:
-                        self.inventory_position -= remaining_order
-                        self.on_hand_inventory -= remaining_order
-                self.env.process(self.ship(order.orderQty, order.requester))
-            else:
-                yield self.env.timeout(1.0)
-
-    # process to deliver replenishment
-    def ship(self, qty, requester):
-        lead_time = requester.defaultLeadTime + \
-                    np.random.choice(requester.leadTimeDelay, replace=True)  # bootstrap sample lead time delay
-        yield self.env.timeout(lead_time)
-        requester.on_hand_inventory += qty
-
-    # process to serve customer demand
-    def serve_customer(self):
-        while True:
-            self.onHandMon.append(self.on_hand_inventory)
-            yield self.env.timeout(1.0)
-            demand = np.random.choice(self.histDemand, replace=True)  # bootstrap sample historical
-            self.totalDemand += demand
-            shipment = min(demand + self.totalBackOrder, self.on_hand_inventory)
-            self.on_hand_inventory -= shipment
-            self.inventory_position -= shipment
-            backorder = demand - shipment
-            self.totalBackOrder += backorder
-            self.totalLateSales += max(0.0, backorder)
-
-
-def simulate_network(seedinit, num_nodes, network, initial_inv, ROP,
-                     base_stock, demand, lead_time, lead_time_delay):
-
-    env = simpy.Environment()  # initialize SimPy simulation instance
-    np.random.seed(seedinit)
-
-    nodes = []  # list of the objects of the storage facility class
-
-    for i in range(num_nodes):
-        if i == 0:  # then it is the first supply node, which is assumed to have infinite inventory
-            s = stocking_facility(env, i, 1, initial_inv[i], ROP[i], base_stock[i],
-                                  None, np.zeros(100), lead_time[i], lead_time_delay)
-        else:
-            # first find the upstream facility before invoking the processes
-            for j in range(num_nodes):
-                if network[j][i] == 1: # then j serves i
-                    s = stocking_facility(env, i, 0, initial_inv[i], ROP[i], base_stock[i],
-                                          nodes[j], demand[:, i - 1], lead_time[i], lead_time_delay)
-                    break
-        
-        nodes.append(s)
-
-    env.run(until=360)
-
-    # find the service level of each node
-    for i in range(num_nodes):
-        nodes[i].serviceLevel = 1 - nodes[i].totalLateSales / (nodes[i].totalDemand + 1.0e-5)
-
-    # find the average on-hand inventory of each node
-    for i in range(num_nodes):
-        if i == 0: # then it is the first supply node, which is assumed to have infinite inventory
-            nodes[i].avgOnHand = 0.0
-        else:
-            nodes[i].avgOnHand = np.mean(nodes[i].onHandMon)
-
-    return nodes  # return the storageNode objects
-
+
+"""This module simulates a multi-echelon supply chain
+and calculates inventory profile (along with associated inventory 
+parameters such as on-hand, inventory position, service level, etc.) 
+across time
+
+The system follows a base stock policy with a reorder point
+If inventory position <= ROP, an order of the amount 
+(base stock level - current inventory level) is placed by the
+facility.  Essentially it's equivalent to filling up the tank.
+
+It is assumed that any unfulfilled order is backordered
+and is fulfilled whenever the material is available in the
+inventory.  The service level is estimated based on how
+late the order was fulfilled
+
+One of the key features is that we do not assume any 
+pre-defined distribution for demand and lead time.  We follow a
+data-driven distribution.  In other words, we bootstrap sample 
+from the historical data in order to simulate variability in
+both demand and lead time.  However, this inherently assumes
+that there is no time correlation in historical demand and 
+lead time, as well as the future will be similar to history
+
+All the events happen on integer day boundaries, so the
+simulation does not need a discrete-event scheduler.  It steps
+through the days of the horizon and keeps the replenishments in
+transit in a calendar indexed by their day of arrival.  Each day
+first delivers the replenishments arriving on that day and then
+runs the steps below for every facility, upstream facilities
+before the ones they serve:
+1) Place replenishment order: 
+    Stocking locations place a replenishment order to their
+    upstream facility once the inventory position reaches
+    below reorder point
+2) Fulfill replenishment order:
+    A facility prepares the replenishments ordered by its
+    downstream facilities first-come first-served.  Once an
+    order is prepared, it is put on the calendar for the day
+    it arrives at the downstream facility after lead time
+3) Customer demand:
+    Customer demand is served from on hand inventory of each
+    of the serving locations
+
+Assumption:  The first node is the supply node such as
+a manufacturing plant or a vendor for which we do not
+track inventory, i.e., it operates at 100% service level.
+Upstream facilities must have a lower node index than the
+facilities they serve
+
+"""
+
+__author__ = 'Anshul Agarwal'
+
+
+import numpy as np
+from collections import deque
+from .sampling import HORIZON, draw_samples
+
+
+def simulate_network(seedinit, num_nodes, network, initial_inv, ROP,
+                     base_stock, demand, lead_time, lead_time_delay, samples=None):
+
+    # bootstrap sample the historical demand of every day and the
+    # lead time delay of every replenishment for all the nodes upfront,
+    # unless the samples are given, e.g., as common random numbers
+    if samples is None:
+        samples = draw_samples(seedinit, num_nodes, demand, lead_time_delay)
+    demand_samples, lt_samples = samples
+
+    # upstream facility of each node, the first supply node has none
+    upstream = [None] * num_nodes
+    for i in range(1, num_nodes):
+        for j in range(num_nodes):
+            if network[j][i] == 1: # then j serves i
+                upstream[i] = j
+                break
+
+    # facility state, as plain lists indexed by node
+    on_hand = [float(x) for x in initial_inv]
+    inv_pos = list(on_hand)
+    reorder_point = [1.05 * float(x) for x in ROP]  # add 5% to avoid rounding issues
+    base_stock = [float(x) for x in base_stock]
+    lead_time = [int(x) for x in lead_time]
+    demand_series = demand_samples.tolist()  # demand of each day
+    lt_series = lt_samples.tolist()  # lead time delay of each replenishment
+    num_shipments = [0] * num_nodes
+    total_demand = [0.0] * num_nodes
+    total_backorder = [0.0] * num_nodes
+    total_late = [0.0] * num_nodes
+
+    # replenishment orders (requester, quantity) queued at each facility
+    # and the quantity of the first queued order still to be prepared
+    order_q = [deque() for _ in range(num_nodes)]
+    remaining_order = [None] * num_nodes
+
+    # replenishments (requester, quantity) arriving on each day,
+    # those arriving after the horizon are never delivered
+    calendar = [[] for _ in range(HORIZON)]
+
+    on_hand_series = np.empty((HORIZON, num_nodes))  # on-hand inventory of each day
+    on_hand_series[0] = on_hand
+
+    for t in range(1, HORIZON):
+
+        # deliver replenishment
+        for requester, qty in calendar[t]:
+            on_hand[requester] += qty
+
+        for i in range(num_nodes):
+
+            # place replenishment order
+            if i != 0 and inv_pos[i] <= reorder_point[i]:
+                order_qty = base_stock[i] - on_hand[i]
+                order_q[upstream[i]].append((i, order_qty))
+                inv_pos[i] += order_qty
+
+            # fulfill replenishment order in the order they were placed
+            queue = order_q[i]
+            while queue:
+                requester, order_qty = queue[0]
+                if remaining_order[i] is None:
+                    shipment = min(order_qty, on_hand[i])
+                    if i != 0:
+                        inv_pos[i] -= shipment
+                        on_hand[i] -= shipment
+                    remaining_order[i] = order_qty - shipment
+
+                # if the order is not complete, wait for the material to appear
+                # in the inventory before the complete replenishment can be sent
+                if remaining_order[i]:
+                    if not on_hand[i] >= remaining_order[i]:
+                        break
+                    if i != 0:
+                        inv_pos[i] -= remaining_order[i]
+                        on_hand[i] -= remaining_order[i]
+
+                queue.popleft()
+                remaining_order[i] = None
+
+                arrival = t + lead_time[requester] + lt_series[requester][num_shipments[requester]]
+                num_shipments[requester] += 1
+                if arrival == t:
+                    on_hand[requester] += order_qty
+                elif arrival < HORIZON:
+                    calendar[arrival].append((requester, order_qty))
+
+            # serve customer demand
+            if i != 0:
+                d = demand_series[t - 1][i - 1]
+                total_demand[i] += d
+                shipment = min(d + total_backorder[i], on_hand[i])
+                on_hand[i] -= shipment
+                inv_pos[i] -= shipment
+                backorder = d - shipment
+                total_backorder[i] += backorder
+                total_late[i] += max(0.0, backorder)
+
+        on_hand_series[t] = on_hand
+
+    # find the service level of each node
+    service_levels = 1 - np.array(total_late) / (np.array(total_demand) + 1.0e-5)
+
+    # find the average on-hand inventory of each node
+    avg_on_hand = on_hand_series.mean(axis=0)
+    avg_on_hand[0] = 0.0  # the first supply node is assumed to have infinite inventory
+
+    return service_levels, avg_on_hand
@@ -0,0 +1,238 @@
+
+"""This module is a compiled version of the backorder simulation
+in simBackorder.py
+
+The loop over the days of the simulation horizon is compiled
+with Numba.  All the facility state is kept in NumPy arrays indexed
+by node (structure of arrays), the order queues in fixed size
+arrays and the replenishments in transit in a table indexed by node
+and arrival day, so there are no Python objects created while the
+simulation runs
+
+Each simulated day first delivers the replenishments arriving on
+that day and then runs the steps below for every facility, in the
+same order as simBackorder.py:
+1) Place replenishment order:
+    The facility places an order to its upstream facility if its
+    inventory position is at or below the reorder point
+2) Fulfill replenishment order:
+    The facility works through its order queue first-come
+    first-served.  An order is shipped once it is complete and
+    arrives after the bootstrapped lead time
+3) Customer demand:
+    Customer demand is served from on hand inventory and any
+    unfulfilled demand is backordered
+
+specialize_network compiles the simulation for a given network,
+with the number of nodes, the upstream facilities and the default
+lead times folded in as constants.  The function it returns runs all
+the replications of an objective evaluation in a single call, with
+the replication as the leading axis of the samples and of the
+results.  The replications are independent and are spread over
+threads with prange, so there is no process pool or pickling involved,
+unless it is compiled serial for callers that run in parallel processes
+
+As in simBackorder.py, upstream facilities must have a lower node
+index than the facilities they serve
+
+Assumption:  The first node is the supply node such as
+a manufacturing plant or a vendor for which we do not
+track inventory, i.e., it operates at 100% service level
+
+"""
+
+
+from numba import njit, prange
+import numpy as np
+from .sampling import HORIZON, draw_samples
+
+
+# upstream facility of each node, the source node has none
+@njit(cache=True)
+def upstream_nodes(num_nodes, network):
+    upstream = np.full(num_nodes, -1, dtype=np.int64)
+    for i in range(1, num_nodes):
+        for j in range(num_nodes):
+            if network[j, i] == 1:  # then j serves i
+                upstream[i] = j
+                break
+    return upstream
+
+
+# simulate one replication, writing the service level and the
+# average on-hand inventory of each node into the given arrays
+@njit(cache=True)
+def simulate_replication(num_nodes, upstream, initialInv, ROP, baseStock,
+                         demand_samples, lead_time, lt_samples,
+                         service_levels, avg_on_hand):
+
+    # the state is kept in float64 and int64.  The loop is a serial
+    # dependency chain over a few nodes, so float32 and int32 state
+    # was measured no faster, and it would not reproduce simBackorder.py
+    on_hand = initialInv.copy()
+    inv_pos = initialInv.copy()
+    total_demand = np.zeros(num_nodes)
+    total_backorder = np.zeros(num_nodes)
+    total_late = np.zeros(num_nodes)
+    on_hand_sum = np.zeros(num_nodes)
+    num_shipments = np.zeros(num_nodes, dtype=np.int64)
+
+    # replenishment quantity arriving on each day at each node
+    pending = np.zeros((HORIZON, num_nodes))
+
+    # order queue of each facility, at most one order per
+    # downstream facility per day.  An entry is always written
+    # before it is read, so the queues are not zeroed
+    num_downstream = np.zeros(num_nodes, dtype=np.int64)
+    for i in range(1, num_nodes):
+        num_downstream[upstream[i]] += 1
+    q_size = HORIZON * num_downstream.max()
+    q_requester = np.empty((num_nodes, q_size), dtype=np.int64)
+    q_qty = np.empty((num_nodes, q_size))
+    q_head = np.zeros(num_nodes, dtype=np.int64)
+    q_tail = np.zeros(num_nodes, dtype=np.int64)
+    q_started = np.zeros(num_nodes, dtype=np.bool_)
+    q_remaining = np.zeros(num_nodes)
+
+    for i in range(num_nodes):
+        on_hand_sum[i] += on_hand[i]
+
+    # all the steps of a day run in a single pass over the nodes.  A
+    # node's on-hand inventory is only changed by the node itself and
+    # by its upstream facility, which comes first, so the replenishment
+    # arriving at a node can be delivered at the start of its own turn
+    # and its on-hand inventory recorded at the end of it
+    for t in range(1, HORIZON):
+        for i in range(num_nodes):
+
+            # deliver replenishment
+            on_hand[i] += pending[t, i]
+
+            # place replenishment order
+            if i != 0 and inv_pos[i] <= 1.05 * ROP[i]:  # add 5% to avoid rounding issues
+                order_qty = baseStock[i] - on_hand[i]
+                u = upstream[i]
+                q_requester[u, q_tail[u]] = i
+                q_qty[u, q_tail[u]] = order_qty
+                q_tail[u] += 1
+                inv_pos[i] += order_qty
+
+            # fulfill replenishment order
+            while q_head[i] < q_tail[i]:
+                order_qty = q_qty[i, q_head[i]]
+                if not q_started[i]:
+                    shipment = min(order_qty, on_hand[i])
+                    if i != 0:
+                        inv_pos[i] -= shipment
+                        on_hand[i] -= shipment
+                    q_remaining[i] = order_qty - shipment
+                    q_started[i] = True
+
+                # if the order is not complete, wait for the material to appear
+                # in the inventory before the complete replenishment can be sent
+                if q_remaining[i] > 0:
+                    if on_hand[i] < q_remaining[i]:
+                        break
+                    if i != 0:
+                        inv_pos[i] -= q_remaining[i]
+                        on_hand[i] -= q_remaining[i]
+
+                r = q_requester[i, q_head[i]]
+                arrival = t + lead_time[r] + lt_samples[r, num_shipments[r]]
+                num_shipments[r] += 1
+                if arrival == t:
+                    on_hand[r] += order_qty
+                elif arrival < HORIZON:
+                    pending[arrival, r] += order_qty
+
+                q_head[i] += 1
+                q_started[i] = False
+
+            # serve customer demand
+            if i != 0:
+                d = demand_samples[t - 1, i - 1]
+                total_demand[i] += d
+                shipment = min(d + total_backorder[i], on_hand[i])
+                on_hand[i] -= shipment
+                inv_pos[i] -= shipment
+                backorder = d - shipment
+                total_backorder[i] += backorder
+                total_late[i] += max(0.0, backorder)
+
+            on_hand_sum[i] += on_hand[i]
+
+    # find the service level and the average on-hand inventory of each node
+    for i in range(num_nodes):
+        service_levels[i] = 1 - total_late[i] / (total_demand[i] + 1.0e-5)
+        avg_on_hand[i] = on_hand_sum[i] / HORIZON
+    avg_on_hand[0] = 0.0  # the supply node is assumed to have infinite inventory
+
+
+@njit(cache=True)
+def simulate_network_numba(num_nodes, network, initialInv, ROP, baseStock,
+                           demand_samples, lead_time, lt_samples):
+
+    service_levels = np.empty(num_nodes)
+    avg_on_hand = np.empty(num_nodes)
+    simulate_replication(num_nodes, upstream_nodes(num_nodes, network),
+                         initialInv, ROP, baseStock, demand_samples, lead_time,
+                         lt_samples, service_levels, avg_on_hand)
+
+    return service_levels, avg_on_hand
+
+
+def simulate_network(seedinit, num_nodes, network, initial_inv, ROP,
+                     base_stock, demand, lead_time, lead_time_delay, samples=None):
+
+    # bootstrap sample the historical demand of every day and the
+    # lead time delay of every replenishment for all the nodes upfront,
+    # unless the samples are given, e.g., as common random numbers
+    if samples is None:
+        samples = draw_samples(seedinit, num_nodes, demand, lead_time_delay)
+    demand_samples, lt_samples = samples
+
+    return simulate_network_numba(num_nodes,
+                                  np.asarray(network, dtype=np.float64),
+                                  np.asarray(initial_inv, dtype=np.float64),
+                                  np.asarray(ROP, dtype=np.float64),
+                                  np.asarray(base_stock, dtype=np.float64),
+                                  np.ascontiguousarray(demand_samples, dtype=np.float64),
+                                  np.asarray(lead_time, dtype=np.int64),
+                                  np.ascontiguousarray(lt_samples, dtype=np.int64))
+
+
+# build a simulate_replications for a fixed network.  The number of
+# nodes, the upstream facility and the default lead time of each node
+# are captured as constants of the compiled function and the
+# simulation loop is inlined into it, so LLVM can fold them into the
+# code instead of loading them from arrays.  The returned function
+# takes the samples of all the replications stacked along a leading
+# axis, e.g., by sampling.stack_samples, and returns (replications,
+# num_nodes) arrays of service levels and average on-hand inventory.
+# The replications are spread over threads unless parallel is False,
+# e.g., when the caller already runs one simulation per core
+def specialize_network(num_nodes, network, lead_time, parallel=True):
+
+    upstream = upstream_nodes(num_nodes, np.asarray(network, dtype=np.float64))
+    default_lead_time = np.array(lead_time, dtype=np.int64)
+    simulate_inlined = njit(inline='always')(simulate_replication.py_func)
+
+    @njit(parallel=parallel)
+    def simulate_specialized(initialInv, ROP, baseStock, demand_samples, lt_samples):
+        replications = demand_samples.shape[0]
+        service_levels = np.empty((replications, num_nodes))
+        avg_on_hand = np.empty((replications, num_nodes))
+        for r in prange(replications):
+            simulate_inlined(num_nodes, upstream, initialInv, ROP, baseStock,
+                             demand_samples[r], default_lead_time, lt_samples[r],
+                             service_levels[r], avg_on_hand[r])
+        return service_levels, avg_on_hand
+
+    def simulate_replications(initial_inv, ROP, base_stock, demand_samples, lt_samples):
+        return simulate_specialized(np.asarray(initial_inv, dtype=np.float64),
+                                    np.asarray(ROP, dtype=np.float64),
+                                    np.asarray(base_stock, dtype=np.float64),
+                                    np.ascontiguousarray(demand_samples, dtype=np.float64),
+                                    np.ascontiguousarray(lt_samples, dtype=np.int64))
+
+    return simulate_replications
@@ -0,0 +1,175 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True
+
+"""This module is a Cython version of the lost sales simulation
+in simLostSales.py, for when Numba is not available or its compile
+on first call in every worker process is not wanted
+
+It runs the same day loop as simLostSalesNumba.py over typed memory
+views, and is compiled ahead of time into an extension module, from
+the simpy_3.0 directory:
+
+    python setup.py build_ext --inplace
+
+after which it is imported like the other simulation modules.  It is
+not compiled with -ffast-math, which would reorder the floating point
+sums and no longer reproduce simLostSales.py exactly
+
+Each simulated day runs the steps below for every facility, in the
+same order as simLostSales.py:
+1) Place replenishment order:
+    The facility places an order to its upstream facility if its
+    inventory position is at or below the reorder point
+2) Fulfill replenishment order:
+    The facility works through its order queue first-come
+    first-served.  An order is shipped once it is complete and
+    arrives after the bootstrapped lead time
+3) Customer demand:
+    Customer demand is served from on hand inventory and any
+    unfulfilled demand is lost
+
+As in simLostSales.py, upstream facilities must have a lower node
+index than the facilities they serve
+
+Assumption:  The first node is the supply node such as
+a manufacturing plant or a vendor for which we do not
+track inventory, i.e., it operates at 100% service level
+
+"""
+
+
+import numpy as np
+from .sampling import HORIZON, draw_samples
+
+
+cdef void simulate_replication(Py_ssize_t num_nodes, const Py_ssize_t[:] upstream,
+                               const double[:] initialInv, const double[:] ROP,
+                               const double[:] baseStock, const double[:, :] demand_samples,
+                               const Py_ssize_t[:] lead_time, const Py_ssize_t[:, :] lt_samples,
+                               double[:] service_levels, double[:] avg_on_hand):
+
+    cdef Py_ssize_t horizon = HORIZON
+    cdef Py_ssize_t i, u, r, t, arrival
+    cdef double order_qty, shipment, d
+
+    cdef double[:] on_hand = np.array(initialInv, dtype=np.float64)
+    cdef double[:] inv_pos = np.array(initialInv, dtype=np.float64)
+    cdef double[:] total_demand = np.zeros(num_nodes)
+    cdef double[:] total_shipped = np.zeros(num_nodes)
+    cdef double[:] on_hand_sum = np.zeros(num_nodes)
+    cdef Py_ssize_t[:] num_shipments = np.zeros(num_nodes, dtype=np.intp)
+
+    # replenishment quantity arriving on each day at each node
+    cdef double[:, :] pending = np.zeros((horizon, num_nodes))
+
+    # order queue of each facility, at most one order per
+    # downstream facility per day
+    num_downstream = np.zeros(num_nodes, dtype=np.intp)
+    for i in range(1, num_nodes):
+        num_downstream[upstream[i]] += 1
+    cdef Py_ssize_t q_size = horizon * num_downstream.max()
+    cdef Py_ssize_t[:, :] q_requester = np.empty((num_nodes, q_size), dtype=np.intp)
+    cdef double[:, :] q_qty = np.empty((num_nodes, q_size))
+    cdef Py_ssize_t[:] q_head = np.zeros(num_nodes, dtype=np.intp)
+    cdef Py_ssize_t[:] q_tail = np.zeros(num_nodes, dtype=np.intp)
+    cdef unsigned char[:] q_started = np.zeros(num_nodes, dtype=np.uint8)
+    cdef double[:] q_remaining = np.zeros(num_nodes)
+
+    for i in range(num_nodes):
+        on_hand_sum[i] += on_hand[i]
+
+    # all the steps of a day run in a single pass over the nodes, as in
+    # simLostSalesNumba.py
+    for t in range(1, horizon):
+        for i in range(num_nodes):
+
+            # deliver replenishment
+            on_hand[i] += pending[t, i]
+
+            # place replenishment order
+            if i != 0 and inv_pos[i] <= 1.05 * ROP[i]:  # add 5% to avoid rounding issues
+                order_qty = baseStock[i] - on_hand[i]
+                u = upstream[i]
+                q_requester[u, q_tail[u]] = i
+                q_qty[u, q_tail[u]] = order_qty
+                q_tail[u] += 1
+                inv_pos[i] += order_qty
+
+            # fulfill replenishment order
+            while q_head[i] < q_tail[i]:
+                order_qty = q_qty[i, q_head[i]]
+                if not q_started[i]:
+                    shipment = min(order_qty, on_hand[i])
+                    if i != 0:
+                        inv_pos[i] -= shipment
+                        on_hand[i] -= shipment
+                    q_remaining[i] = order_qty - shipment
+                    q_started[i] = 1
+
+                # if the order is not complete, wait for the material to appear
+                # in the inventory before the complete replenishment can be sent
+                if q_remaining[i] > 0:
+                    if on_hand[i] < q_remaining[i]:
+                        break
+                    if i != 0:
+                        inv_pos[i] -= q_remaining[i]
+                        on_hand[i] -= q_remaining[i]
+
+                r = q_requester[i, q_head[i]]
+                arrival = t + lead_time[r] + lt_samples[r, num_shipments[r]]
+                num_shipments[r] += 1
+                if arrival == t:
+                    on_hand[r] += order_qty
+                elif arrival < horizon:
+                    pending[arrival, r] += order_qty
+
+                q_head[i] += 1
+                q_started[i] = 0
+
+            # serve customer demand
+            if i != 0:
+                d = demand_samples[t - 1, i - 1]
+                total_demand[i] += d
+                shipment = min(d, on_hand[i])
+                total_shipped[i] += shipment
+                on_hand[i] -= shipment
+                inv_pos[i] -= shipment
+
+            on_hand_sum[i] += on_hand[i]
+
+    # find the service level and the average on-hand inventory of each node
+    for i in range(num_nodes):
+        service_levels[i] = total_shipped[i] / (total_demand[i] + 1.0e-5)
+        avg_on_hand[i] = on_hand_sum[i] / horizon
+    avg_on_hand[0] = 0.0  # the supply node is assumed to have infinite inventory
+
+
+cpdef simulate_network(seedinit, num_nodes, network, initial_inv, ROP,
+                       base_stock, demand, lead_time, lead_time_delay, samples=None):
+
+    # bootstrap sample the historical demand of every day and the
+    # lead time delay of every replenishment for all the nodes upfront,
+    # unless the samples are given, e.g., as common random numbers
+    if samples is None:
+        samples = draw_samples(seedinit, num_nodes, demand, lead_time_delay)
+    demand_samples, lt_samples = samples
+
+    # upstream facility of each node, the source node has none
+    upstream = np.full(num_nodes, -1, dtype=np.intp)
+    for i in range(1, num_nodes):
+        for j in range(num_nodes):
+            if network[j][i] == 1:  # then j serves i
+                upstream[i] = j
+                break
+
+    service_levels = np.empty(num_nodes)
+    avg_on_hand = np.empty(num_nodes)
+    simulate_replication(num_nodes, upstream,
+                         np.asarray(initial_inv, dtype=np.float64),
+                         np.asarray(ROP, dtype=np.float64),
+                         np.asarray(base_stock, dtype=np.float64),
+                         np.ascontiguousarray(demand_samples, dtype=np.float64),
+                         np.asarray(lead_time, dtype=np.intp),
+                         np.ascontiguousarray(lt_samples, dtype=np.intp),
+                         service_levels, avg_on_hand)
+
+    return service_levels, avg_on_hand